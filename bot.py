@@ -1,14 +1,21 @@
 import asyncio
+import hashlib
 import logging
 import os
 import re
+import time
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import CommandStart
 from dotenv import load_dotenv
 
-from db import get_db_connection, execute_query
-from llm import get_sql_from_llm
+from db import init_pool, close_pool, acquire, execute_query
+from llm import get_sql_from_llm, close_client
+
+try:
+    import uvloop
+except ImportError:  # uvloop не поддерживает Windows
+    uvloop = None
 
 load_dotenv()
 
@@ -20,39 +27,51 @@ logger = logging.getLogger(__name__)
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
 dp = Dispatcher()
 
+# Ограничение числа одновременных обращений к LLM: всплеск сообщений иначе
+# упирается в rate limit API и уходит в дорогие повторы с backoff.
+# Одновременные запросы к БД уже ограничены размером пула соединений.
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_QUEUE_TIMEOUT = 10.0
+_llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
 
-async def swap_video_id_to_creator_id(query: str) -> str:
-    """
-    Функция ищет UUID в запросе, проверяет, является ли он ID видео,
-    и если да, заменяет его на ID креатора.
-    """
-    match = re.search(r'([a-f\d]{8}-[a-f\d]{4}-[a-f\d]{4}-[a-f\d]{4}-[a-f\d]{12})', query)
-    if not match:
-        return query
+# Кэш "вопрос -> (sql, результат)" для дословно повторяющихся запросов.
+# Запросы с относительными датами не кэшируются: их результат устаревает.
+# Размер ограничен: при переполнении вытесняется самая старая запись (LRU —
+# dict хранит порядок вставки, попадание переносит запись в конец).
+RESULT_CACHE_TTL = 3600
+RESULT_CACHE_MAX_SIZE = 1024
+_RELATIVE_DATE_RE = re.compile(r'сегодня|вчера|позавчера|сейчас|последн', re.IGNORECASE)
+_result_cache: dict[str, tuple[float, str, str]] = {}
+_result_cache_lock = asyncio.Lock()
 
-    entity_id_str = match.group(1)
-    logger.info(f"Найден UUID: {entity_id_str}")
 
-    db_conn = await get_db_connection()
-    if db_conn is None:
-        logger.error("Не удалось подключиться к базе данных для проверки ID.")
-        return query 
+def _cache_key(query: str) -> str:
+    """Функция вычисляет ключ кэша по нормализованному тексту запроса."""
+    return hashlib.blake2b(query.strip().lower().encode()).hexdigest()
 
-    try:
-        creator_id_from_video = await execute_query(db_conn, f"SELECT creator_id FROM videos WHERE id = '{entity_id_str}'")
-        if creator_id_from_video:
-            logger.info(f"UUID является ID видео. Найден ID креатора: {creator_id_from_video}")
-            return query.replace(entity_id_str, str(creator_id_from_video))
-        
-        logger.info("Найденный UUID не является ID видео. Предполагаем, что это ID креатора или не относится к видео.")
 
-    except Exception as e:
-        logger.error(f"Ошибка при проверке ID: {e}", exc_info=True)
-    finally:
-        if db_conn:
-            await db_conn.close()
+# Сгенерированный LLM SQL выполняется только если это одиночный SELECT:
+# дешёвая проверка регулярным выражением отсекает DDL/DML и многооператорные
+# запросы до обращения к базе данных.
+_SAFE_SQL_RE = re.compile(r'^\s*SELECT\b[^;]*;?\s*$', re.IGNORECASE | re.DOTALL)
 
-    return query
+
+def is_safe_sql(sql_query: str) -> bool:
+    """Функция проверяет, что SQL-запрос — одиночный SELECT."""
+    return bool(_SAFE_SQL_RE.match(sql_query))
+
+
+async def _keep_typing(chat_id: int):
+    """
+    Фоновая задача: поддерживает статус "печатает...", пока готовится ответ.
+    Статус в Telegram живёт ~5 секунд, поэтому действие повторяется каждые 4.
+    """
+    try:
+        while True:
+            await bot.send_chat_action(chat_id, 'typing')
+            await asyncio.sleep(4)
+    except asyncio.CancelledError:
+        pass
 
 
 @dp.message(CommandStart())
@@ -74,39 +93,70 @@ async def handle_query(message: types.Message):
     Основной обработчик для текстовых запросов пользователя.
 
     1. Получает текстовый запрос.
-    2. Проверяет UUID и при необходимости заменяет video_id на creator_id.
-    3. Отправляет запрос к LLM для генерации SQL.
-    4. Выполняет SQL-запрос к базе данных.
-    5. Отправляет результат пользователю.
+    2. Отправляет запрос к LLM для генерации SQL (UUID видео разрешается
+       в creator_id прямо в сгенерированном SQL, без отдельного запроса к БД).
+    3. Выполняет SQL-запрос к базе данных.
+    4. Отправляет результат пользователю.
     """
     user_query = message.text
-    logger.info(f"Получен новый запрос от пользователя: {user_query}")
+    if not user_query:
+        await message.answer("Я понимаю только текстовые вопросы. Отправьте вопрос текстом.")
+        return
 
+    logger.info(f"Получен новый запрос от пользователя: {user_query}")
 
+    cache_key = _cache_key(user_query)
+    async with _result_cache_lock:
+        cached = _result_cache.get(cache_key)
+        if cached is not None:
+            if time.monotonic() - cached[0] < RESULT_CACHE_TTL:
+                _result_cache[cache_key] = _result_cache.pop(cache_key)
+            else:
+                _result_cache.pop(cache_key, None)
+                cached = None
+    if cached is not None:
+        _, cached_sql, cached_result = cached
+        logger.info(f"Ответ найден в кэше (SQL: {cached_sql}).")
+        await message.answer(cached_result)
+        return
 
+    typing_task = asyncio.create_task(_keep_typing(message.chat.id))
     try:
-        modified_query = await swap_video_id_to_creator_id(user_query)
-        if modified_query != user_query:
-            logger.info(f"Запрос был изменен: {modified_query}")
+        try:
+            await asyncio.wait_for(_llm_semaphore.acquire(), timeout=LLM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Очередь к LLM переполнена, запрос отклонён.")
+            await message.answer("Бот сейчас перегружен. Попробуйте ещё раз через несколько секунд.")
+            return
+
+        try:
+            sql_query = await get_sql_from_llm(user_query)
+        finally:
+            _llm_semaphore.release()
 
-        sql_query = await get_sql_from_llm(modified_query)
         if not sql_query or sql_query == "ERROR":
             await message.answer("Не удалось понять ваш запрос или сгенерировать SQL. Попробуйте переформулировать его.")
             return
 
         logger.info(f"Сгенерирован SQL-запрос: {sql_query}")
 
-        db_conn = await get_db_connection()
-        if db_conn is None:
-            await message.answer("Не удалось подключиться к базе данных. Попробуйте позже.")
+        if not is_safe_sql(sql_query):
+            logger.warning(f"SQL-запрос не прошёл проверку безопасности: {sql_query}")
+            await message.answer("Сгенерированный запрос не прошёл проверку. Попробуйте переформулировать вопрос.")
             return
 
-        result = await execute_query(db_conn, sql_query)
-        await db_conn.close()
+        async with acquire() as conn:
+            result = await execute_query(conn, sql_query)
 
         logger.info(f"Результат выполнения запроса: {result}")
 
         if result is not None:
+            if not _RELATIVE_DATE_RE.search(user_query):
+                async with _result_cache_lock:
+                    _result_cache.pop(cache_key, None)
+                    while len(_result_cache) >= RESULT_CACHE_MAX_SIZE:
+                        _result_cache.pop(next(iter(_result_cache)))
+                    _result_cache[cache_key] = (time.monotonic(), sql_query, f"{result}")
             await message.answer(f"{result}")
         else:
             await message.answer("Не удалось получить результат. Возможно, запрос некорректен или данные отсутствуют.")
@@ -114,6 +164,8 @@ async def handle_query(message: types.Message):
     except Exception as e:
         logger.error(f"Ошибка при обработке запроса: {e}", exc_info=True)
         await message.answer("Произошла внутренняя ошибка. Пожалуйста, попробуйте позже.")
+    finally:
+        typing_task.cancel()
 
 
 async def main():
@@ -125,8 +177,15 @@ async def main():
         return
 
     logger.info("Бот запускается...")
-    await dp.start_polling(bot)
+    await init_pool()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await close_pool()
+        await close_client()
 
 
 if __name__ == '__main__':
+    if uvloop is not None:
+        uvloop.install()
     asyncio.run(main())
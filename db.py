@@ -1,5 +1,6 @@
 import os
 import asyncpg
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import logging
 
@@ -13,31 +14,50 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
-async def get_db_connection():
+_pool: asyncpg.Pool | None = None
+
+async def init_pool():
     """
-    Функция устанавливает и возвращает асинхронное соединение с базой данных.
-    
-    Returns:
-        asyncpg.Connection | None: Объект соединения или None в случае ошибки.
+    Функция создаёт пул соединений с базой данных.
+    Вызывается один раз при старте бота, до начала обработки сообщений.
     """
-    try:
-        conn = await asyncpg.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        logger.info("Установлено соединение с базой данных.")
-        return conn
-    except asyncpg.exceptions.PostgresError as e:
-        logger.error(f"Ошибка подключения к базе данных: {e}", exc_info=True)
-        return None
-    except Exception as e:
-        logger.error(f"Непредвиденная ошибка при подключении к БД: {e}", exc_info=True)
-        return None
+    global _pool
+    _pool = await asyncpg.create_pool(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        min_size=2,
+        max_size=10,
+        command_timeout=30,
+        statement_cache_size=1024
+    )
+    logger.info("Пул соединений с базой данных создан.")
+
+async def close_pool():
+    """Функция закрывает пул соединений при остановке бота."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+        logger.info("Пул соединений с базой данных закрыт.")
+
+@asynccontextmanager
+async def acquire():
+    """
+    Асинхронный контекстный менеджер, выдающий соединение из пула.
+    Соединение автоматически возвращается в пул при выходе из блока.
+
+    Yields:
+        asyncpg.Connection: Соединение из пула.
+    """
+    if _pool is None:
+        raise RuntimeError("Пул соединений не инициализирован. Вызовите init_pool() при старте.")
+    async with _pool.acquire() as conn:
+        yield conn
 
-async def execute_query(conn: asyncpg.Connection, query: str):
+async def execute_query(conn: asyncpg.Connection, query: str, *args):
     """
     Функция выполняет SQL-запрос и возвращает первый результат.
     Предназначена для запросов, возвращающих одно число.
@@ -45,12 +65,14 @@ async def execute_query(conn: asyncpg.Connection, query: str):
     Args:
         conn (asyncpg.Connection): Активное соединение с БД.
         query (str): SQL-запрос для выполнения.
+        *args: Значения для позиционных параметров запроса ($1, $2, ...).
+               Параметризованные запросы переиспользуют подготовленные планы.
 
     Returns:
         Any | None: Результат запроса (одно значение) или None в случае ошибки.
     """
     try:
-        result = await conn.fetchval(query)
+        result = await conn.fetchval(query, *args)
         return result
     except asyncpg.exceptions.PostgresError as e:
         logger.error(f"Ошибка выполнения SQL-запроса: {e}\nЗапрос: {query}", exc_info=True)
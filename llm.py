@@ -1,16 +1,35 @@
+import functools
 import os
 import httpx
+import orjson
 from dotenv import load_dotenv
 import logging
 import asyncio
 
+from llm_cache import semantic_cache
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
 AGENTPLATFORM_KEY = os.getenv("AGENTPLATFORM_KEY")
 
-PROMPT_TEMPLATE = """
+# Один HTTP-клиент на весь процесс: keep-alive соединения к LLM-шлюзу
+# переиспользуются между запросами, без TLS-рукопожатия на каждое сообщение.
+_client = httpx.AsyncClient(
+    http2=True,
+    timeout=60.0,
+    limits=httpx.Limits(max_keepalive_connections=20)
+)
+
+async def close_client():
+    """Функция закрывает общий HTTP-клиент. Вызывается при остановке бота."""
+    await _client.aclose()
+
+# Весь неизменный текст (роль, схема, правила, примеры) вынесен в системное
+# сообщение, которое провайдер может закэшировать как стабильный префикс.
+# В пользовательском сообщении остаётся только сам запрос.
+SYSTEM_PROMPT_TEMPLATE = """
 Ты — продвинутый AI-ассистент, который преобразует запросы на естественном языке в SQL-запросы для базы данных PostgreSQL.
 Твоя задача — сгенерировать ТОЛЬКО ОДИН SQL-запрос, который точно соответствует вопросу пользователя. НЕ добавляй никаких пояснений, комментариев или дополнительного текста. Только SQL.
 
@@ -27,29 +46,33 @@ PROMPT_TEMPLATE = """
     -   `video_created_at` в таблице `videos` — это дата публикации видео.
     -   `created_at` в таблице `video_snapshots` — это время замера.
     -   Пример вопроса: "Сколько видео у креатора с id aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee вышло с 1 ноября 2025 по 5 ноября 2025 включительно?"
-    -   Правильный ответ: SELECT COUNT(*) FROM videos WHERE creator_id = 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee' AND video_created_at BETWEEN '2025-11-01' AND '2025-11-05 23:59:59';
+    -   Правильный ответ: SELECT COUNT(*) FROM videos WHERE creator_id = COALESCE((SELECT creator_id FROM videos WHERE id = 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee'), 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee') AND video_created_at BETWEEN '2025-11-01' AND '2025-11-05 23:59:59';
 
-3.  **Считай прирост по дельтам.** Для вопросов о приросте используй `delta_*` поля в `video_snapshots`.
+3.  **Считай прирост по дельтам.** Для вопросов о приросте за целый день используй materialized view `daily_video_stats` (колонки video_id, day и суммы delta_* за день) — это быстрее, чем сканировать `video_snapshots`. Поля `delta_*` в `video_snapshots` нужны только для вопросов про отдельные замеры внутри дня.
     -   Пример вопроса: "На сколько просмотров в сумме выросли все видео 28 ноября 2025?"
-    -   Правильный ответ: SELECT SUM(delta_views_count) FROM video_snapshots WHERE DATE(created_at) = '2025-11-28';
+    -   Правильный ответ: SELECT SUM(delta_views_count) FROM daily_video_stats WHERE day = '2025-11-28';
 
-4.  **Считай уникальные сущности.** Для вопросов о "разных" или "уникальных" видео используй `COUNT(DISTINCT ...)`.
+4.  **Считай уникальные сущности.** Для вопросов о "разных" или "уникальных" видео используй `COUNT(DISTINCT ...)`. В `daily_video_stats` каждая пара (video_id, day) встречается один раз, поэтому там достаточно COUNT(*).
     -   Пример вопроса: "Сколько разных видео получали новые просмотры 27 ноября 2025?"
-    -   Правильный ответ: SELECT COUNT(DISTINCT video_id) FROM video_snapshots WHERE DATE(created_at) = '2025-11-27' AND delta_views_count > 0;
+    -   Правильный ответ: SELECT COUNT(*) FROM daily_video_stats WHERE day = '2025-11-27' AND delta_views_count > 0;
     
 5.  **Фильтруй по финальным значениям.** Для вопросов типа "больше X просмотров" используй итоговые счётчики в таблице `videos`.
     -   Пример вопроса: "Сколько видео набрало больше 100000 просмотров за всё время?"
     -   Правильный ответ: SELECT COUNT(*) FROM videos WHERE views_count > 100000;
 
-Теперь, основываясь на этой схеме и примерах, преобразуй следующий запрос. Помни: только SQL-код.
-
-Запрос пользователя: "{user_query}"
+6.  **UUID в запросе может быть как ID креатора, так и ID видео.** Если вопрос про креатора, разрешай UUID прямо в SQL: возьми creator_id видео с таким id, а если такого видео нет — используй UUID как есть.
+    -   Пример вопроса: "Сколько видео у креатора aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee?"
+    -   Правильный ответ: SELECT COUNT(*) FROM videos WHERE creator_id = COALESCE((SELECT creator_id FROM videos WHERE id = 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee'), 'aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee');
 
+Теперь, основываясь на этой схеме и примерах, преобразуй запрос пользователя. Помни: только SQL-код.
 Если не можешь сгенерировать корректный запрос, верни одно слово: ERROR.
 """
 
+USER_PROMPT_TEMPLATE = """Запрос пользователя: "{user_query}" """
+
+@functools.lru_cache(maxsize=1)
 def get_schema():
-    """Функция читает схему из SQL-файла."""
+    """Функция читает схему из SQL-файла. Файл читается один раз, результат кэшируется."""
     try:
         with open('sql/init.sql', 'r', encoding='utf-8') as f:
             return f.read()
@@ -57,10 +80,24 @@ def get_schema():
         logger.error("Файл схемы 'sql/init.sql' не найден.")
         return ""
 
-async def get_sql_from_llm(user_query: str, max_retries: int = 3, initial_backoff: float = 5.0) -> str | None:
+# Системный блок собирается один раз при импорте: схема во время работы не
+# меняется, а байт-в-байт стабильный префикс нужен и кэшу провайдера.
+# Для пользовательского сообщения вместо .format остаётся конкатенация.
+_SYSTEM_PROMPT = SYSTEM_PROMPT_TEMPLATE.format(schema=get_schema())
+_USER_PREFIX, _USER_SUFFIX = USER_PROMPT_TEMPLATE.split('{user_query}')
+
+# Пока бот ждёт в backoff, пользователь сидит без ответа, поэтому суммарное
+# ожидание повторов ограничено, а длинный Retry-After сервера — это сигнал
+# сразу вернуть ошибку, а не ждать.
+RETRY_TIME_BUDGET = 5.0
+RETRY_AFTER_LIMIT = 3.0
+
+@semantic_cache
+async def get_sql_from_llm(user_query: str, max_retries: int = 3, initial_backoff: float = 0.5) -> str | None:
     """
     Функция отправляет запрос к LLM API для преобразования текста в SQL.
-    Использует httpx для асинхронных запросов и включает механизм повторных попыток.
+    Использует httpx для асинхронных запросов и включает механизм повторных попыток
+    с ограниченным суммарным временем ожидания.
 
     Args:
         user_query (str): Запрос пользователя на естественном языке.
@@ -74,60 +111,105 @@ async def get_sql_from_llm(user_query: str, max_retries: int = 3, initial_backof
         logger.error("Ключ API AGENTPLATFORM_KEY не найден. Проверьте .env файл.")
         return None
 
-    schema = get_schema()
-    if not schema:
+    if not get_schema():
         return None
-    
-    prompt = PROMPT_TEMPLATE.format(schema=schema, user_query=user_query)
-    
+
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {AGENTPLATFORM_KEY}"
     }
-    
+
     data = {
         "model": "google/gemini-2.5-flash-lite",
-        "messages": [{"role": "user", "content": prompt}]
+        "messages": [
+            {
+                "role": "system",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": _SYSTEM_PROMPT,
+                        "cache_control": {"type": "ephemeral"}
+                    }
+                ]
+            },
+            {"role": "user", "content": _USER_PREFIX + user_query + _USER_SUFFIX}
+        ],
+        "stream": True
     }
     
     url = "https://litellm.tokengate.ru/v1/chat/completions"
     
     attempt = 0
     backoff = initial_backoff
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        while attempt <= max_retries:
-            try:
-                response = await client.post(url, headers=headers, json=data)
-                response.raise_for_status()
-                
-                result = response.json()
-                sql_query = result['choices'][0]['message']['content'].strip()
-
-                if sql_query.lower().startswith("```sql"):
-                    sql_query = sql_query[5:]
-                if sql_query.endswith("```"):
-                    sql_query = sql_query[:-3]
-                if sql_query.endswith(';'):
-                    sql_query = sql_query[:-1]
-
-                return sql_query.strip()
-
-            except httpx.HTTPStatusError as e:
-                logger.error(f"Ошибка API (статус {e.response.status_code}): {e.response.text}", exc_info=True)
-                if e.response.status_code in [429, 500, 502, 503, 504]:
-                    if attempt == max_retries:
-                        logger.error("Достигнуто максимальное количество повторных попыток.")
-                        return None
-                    
-                    logger.warning(f"Попытка {attempt + 1} из {max_retries}. Ожидание {backoff:.2f} сек.")
-                    await asyncio.sleep(backoff)
-                    attempt += 1
-                    backoff *= 2
-                else:
+    deadline = asyncio.get_running_loop().time() + RETRY_TIME_BUDGET
+    while attempt <= max_retries:
+        try:
+            async with _client.stream("POST", url, headers=headers, content=orjson.dumps(data)) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    response.raise_for_status()
+
+                buf = ""
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == "[DONE]":
+                        break
+
+                    chunk = orjson.loads(payload)
+                    choices = chunk.get('choices')
+                    if not choices:
+                        continue
+                    buf += choices[0].get('delta', {}).get('content') or ''
+
+                    # SQL готов: закрылся code-fence или запрос завершён ';'.
+                    # Дальше модель может генерировать только лишний текст,
+                    # поэтому выходим, не дожидаясь конца потока.
+                    if buf.count('```') >= 2 or buf.rstrip().endswith(';'):
+                        break
+
+            sql_query = buf.strip()
+
+            if sql_query.lower().startswith("```sql"):
+                sql_query = sql_query[5:]
+            if sql_query.endswith("```"):
+                sql_query = sql_query[:-3]
+            if sql_query.endswith(';'):
+                sql_query = sql_query[:-1]
+
+            return sql_query.strip()
+
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Ошибка API (статус {e.response.status_code}): {e.response.text}", exc_info=True)
+            if e.response.status_code in [429, 500, 502, 503, 504]:
+                if attempt == max_retries:
+                    logger.error("Достигнуто максимальное количество повторных попыток.")
+                    return None
+
+                try:
+                    retry_after = float(e.response.headers.get('retry-after', '0'))
+                except ValueError:
+                    retry_after = 0.0
+
+                if retry_after > RETRY_AFTER_LIMIT:
+                    logger.error(f"Сервер просит подождать {retry_after:.0f} сек — отвечаем ошибкой сразу.")
+                    return None
+
+                wait = max(backoff, retry_after)
+                if asyncio.get_running_loop().time() + wait > deadline:
+                    logger.error("Бюджет времени на повторные попытки исчерпан.")
                     return None
 
-            except Exception as e:
-                logger.error(f"Непредвиденная ошибка при взаимодействии с API: {e}", exc_info=True)
+                logger.warning(f"Попытка {attempt + 1} из {max_retries}. Ожидание {wait:.2f} сек.")
+                await asyncio.sleep(wait)
+                attempt += 1
+                backoff *= 2
+            else:
                 return None
 
+        except Exception as e:
+            logger.error(f"Непредвиденная ошибка при взаимодействии с API: {e}", exc_info=True)
+            return None
+
     return None
@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CACHE_DB_PATH = 'cache.db'
+EMBEDDING_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'
+EMBEDDING_DIM = 384
+SIMILARITY_THRESHOLD = 0.92
+
+# UUID в запросе означает конкретную сущность: похожие формулировки с разными
+# ID не должны получать один и тот же SQL из кэша.
+_UUID_RE = re.compile(r'[a-f\d]{8}-[a-f\d]{4}-[a-f\d]{4}-[a-f\d]{4}-[a-f\d]{12}', re.IGNORECASE)
+
+_model = None
+_model_lock = threading.Lock()
+_embeddings = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+_sqls: list[str] = []
+_hashes: list[str] = []
+_lock = asyncio.Lock()
+
+
+def _get_model():
+    """
+    Функция лениво загружает модель эмбеддингов при первом обращении.
+    Загрузка сериализована: _embed вызывается из пула потоков, и без блокировки
+    параллельные первые вызовы загрузили бы модель по несколько раз.
+    """
+    global _model
+    with _model_lock:
+        if _model is None:
+            from sentence_transformers import SentenceTransformer
+            logger.info(f"Загрузка модели эмбеддингов '{EMBEDDING_MODEL}'...")
+            _model = SentenceTransformer(EMBEDDING_MODEL)
+    return _model
+
+
+def _embed(query: str) -> np.ndarray:
+    """Функция возвращает нормализованный эмбеддинг запроса."""
+    return _get_model().encode(query, normalize_embeddings=True).astype(np.float32)
+
+
+def _query_hash(query: str) -> str:
+    """Функция вычисляет ключ записи по нормализованному тексту запроса."""
+    return hashlib.blake2b(query.strip().lower().encode()).hexdigest()
+
+
+def _init_db() -> sqlite3.Connection:
+    """Функция открывает SQLite-хранилище кэша и создаёт таблицу при необходимости."""
+    conn = sqlite3.connect(CACHE_DB_PATH)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS cache ('
+        'hash TEXT PRIMARY KEY, '
+        'query TEXT, embedding BLOB, sql_query TEXT, '
+        'ts INTEGER, hits INTEGER DEFAULT 0)'
+    )
+    conn.commit()
+    return conn
+
+
+def _load_cache():
+    """
+    Функция загружает сохранённый кэш из SQLite в память: эмбеддинги — в
+    numpy-матрицу для косинусного поиска, SQL и ключи — в параллельные списки.
+    Благодаря этому после рестарта бот сразу отвечает из кэша.
+    """
+    global _embeddings, _sqls, _hashes
+    try:
+        conn = _init_db()
+        rows = conn.execute('SELECT hash, embedding, sql_query FROM cache ORDER BY ts').fetchall()
+        conn.close()
+        if rows:
+            _embeddings = np.vstack([np.frombuffer(emb, dtype=np.float32) for _, emb, _ in rows])
+            _sqls = [sql for _, _, sql in rows]
+            _hashes = [h for h, _, _ in rows]
+            logger.info(f"Семантический кэш загружен: {len(_sqls)} записей.")
+    except Exception as e:
+        logger.error(f"Не удалось загрузить семантический кэш: {e}", exc_info=True)
+
+
+def _persist(query_hash: str, query: str, embedding: np.ndarray, sql_query: str):
+    """Функция сохраняет новую запись кэша в SQLite, не теряя счётчик попаданий."""
+    try:
+        conn = _init_db()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (hash, query, embedding, sql_query, ts, hits) '
+            'VALUES (?, ?, ?, ?, ?, COALESCE((SELECT hits FROM cache WHERE hash = ?), 0))',
+            (query_hash, query, embedding.tobytes(), sql_query, int(time.time()), query_hash)
+        )
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"Не удалось сохранить запись в семантический кэш: {e}", exc_info=True)
+
+
+def _count_hit(query_hash: str):
+    """Функция увеличивает счётчик попаданий записи кэша."""
+    try:
+        conn = _init_db()
+        conn.execute('UPDATE cache SET hits = hits + 1 WHERE hash = ?', (query_hash,))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"Не удалось обновить счётчик попаданий кэша: {e}", exc_info=True)
+
+
+def semantic_cache(func):
+    """
+    Декоратор, кэширующий результаты text-to-SQL по смысловой близости запросов.
+
+    Перед вызовом LLM запрос кодируется sentence-transformer'ом, и если в кэше
+    уже есть запрос с косинусной близостью выше порога, возвращается ранее
+    сгенерированный SQL без обращения к API. Кэш переживает рестарты: записи
+    хранятся в SQLite (WAL) и загружаются в память при импорте. Запросы с UUID
+    не кэшируются, чтобы не перепутать сущности.
+    """
+    @functools.wraps(func)
+    async def wrapper(user_query: str, *args, **kwargs):
+        global _embeddings
+
+        if _UUID_RE.search(user_query):
+            return await func(user_query, *args, **kwargs)
+
+        try:
+            vector = await asyncio.to_thread(_embed, user_query)
+        except Exception as e:
+            logger.error(f"Ошибка при вычислении эмбеддинга: {e}", exc_info=True)
+            return await func(user_query, *args, **kwargs)
+
+        hit = None
+        async with _lock:
+            if len(_sqls) > 0:
+                similarities = _embeddings @ vector
+                best = int(similarities.argmax())
+                if similarities[best] > SIMILARITY_THRESHOLD:
+                    logger.info(f"Попадание в семантический кэш (similarity={similarities[best]:.3f}).")
+                    hit = (_hashes[best], _sqls[best])
+
+        if hit is not None:
+            best_hash, best_sql = hit
+            await asyncio.to_thread(_count_hit, best_hash)
+            return best_sql
+
+        sql_query = await func(user_query, *args, **kwargs)
+
+        if sql_query and sql_query != "ERROR":
+            query_hash = _query_hash(user_query)
+            async with _lock:
+                _embeddings = np.vstack([_embeddings, vector])
+                _sqls.append(sql_query)
+                _hashes.append(query_hash)
+            await asyncio.to_thread(_persist, query_hash, user_query, vector, sql_query)
+
+        return sql_query
+
+    return wrapper
+
+
+_load_cache()
@@ -1,12 +1,16 @@
 import asyncio
-import json
 import os
-import uuid
-from datetime import datetime
 
 import asyncpg
+import ciso8601
+import orjson
 from dotenv import load_dotenv
 
+try:
+    import uvloop
+except ImportError:  # uvloop не поддерживает Windows
+    uvloop = None
+
 load_dotenv()
 
 DB_HOST = os.getenv("DB_HOST")
@@ -15,11 +19,77 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
+# Индексы целевых таблиц (повторяют sql/init.sql). На время массовой загрузки
+# их дешевле удалить и построить заново, чем поддерживать на каждой строке.
+TARGET_INDEXES = [
+    ('idx_videos_creator_id',
+     'CREATE INDEX IF NOT EXISTS idx_videos_creator_id ON videos(creator_id);'),
+    ('idx_videos_video_created_at',
+     'CREATE INDEX IF NOT EXISTS idx_videos_video_created_at ON videos(video_created_at);'),
+    ('idx_video_snapshots_video_id',
+     'CREATE INDEX IF NOT EXISTS idx_video_snapshots_video_id ON video_snapshots(video_id);'),
+    ('idx_video_snapshots_created_at',
+     'CREATE INDEX IF NOT EXISTS idx_video_snapshots_created_at ON video_snapshots(created_at);'),
+]
+
 async def execute_sql_from_file(conn, file_path):
     """Функция выполняет SQL-скрипт из файла."""
     with open(file_path, 'r', encoding='utf-8') as f:
         await conn.execute(f.read())
 
+def _uuid_bytes(uuid_str):
+    """Функция переводит строковый UUID в 16 байт без создания объекта uuid.UUID."""
+    return bytes.fromhex(uuid_str.replace('-', ''))
+
+async def register_uuid_passthrough(conn):
+    """
+    Функция регистрирует бинарный кодек-passthrough для типа uuid:
+    значения передаются в COPY как готовые 16 байт.
+    """
+    await conn.set_type_codec(
+        'uuid',
+        schema='pg_catalog',
+        format='binary',
+        encoder=lambda b: b,
+        decoder=lambda b: b
+    )
+
+def gen_video_records(videos):
+    """Генератор строк для COPY в таблицу videos (без материализации списка)."""
+    parse_datetime = ciso8601.parse_datetime
+    for video_data in videos:
+        yield (
+            _uuid_bytes(video_data['id']),
+            _uuid_bytes(video_data['creator_id']),
+            parse_datetime(video_data['video_created_at']),
+            video_data['views_count'],
+            video_data['likes_count'],
+            video_data['comments_count'],
+            video_data['reports_count'],
+            parse_datetime(video_data['created_at']),
+            parse_datetime(video_data['updated_at'])
+        )
+
+def gen_snapshot_records(videos):
+    """Генератор строк для COPY в таблицу video_snapshots."""
+    parse_datetime = ciso8601.parse_datetime
+    for video_data in videos:
+        video_id = _uuid_bytes(video_data['id'])
+        for snapshot_data in video_data.get('snapshots', []):
+            yield (
+                _uuid_bytes(snapshot_data['id']),
+                video_id,
+                snapshot_data['views_count'],
+                snapshot_data['likes_count'],
+                snapshot_data['comments_count'],
+                snapshot_data['reports_count'],
+                snapshot_data.get('delta_views_count', 0),
+                snapshot_data.get('delta_likes_count', 0),
+                snapshot_data.get('delta_comments_count', 0),
+                snapshot_data.get('delta_reports_count', 0),
+                parse_datetime(snapshot_data['created_at'])
+            )
+
 async def load_data():
     """
     Функция для загрузки данных из JSON-файла в базу данных PostgreSQL.
@@ -41,76 +111,66 @@ async def load_data():
             database=DB_NAME
         )
         print("Соединение с базой данных установлено.")
+        await register_uuid_passthrough(conn)
         await execute_sql_from_file(conn, 'sql/init.sql')
         print("SQL-скрипт инициализации выполнен.")
 
         try:
-            with open('videos.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            with open('videos.json', 'rb') as f:
+                data = orjson.loads(f.read())
             print("JSON-файл успешно прочитан.")
         except FileNotFoundError:
             print("Ошибка: Файл 'videos.json' не найден. Пожалуйста, убедитесь, что он находится в корневой директории проекта.")
             return
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             print("Ошибка: Не удалось декодировать JSON. Проверьте формат файла.")
             return
 
-        await conn.execute('TRUNCATE TABLE video_snapshots, videos RESTART IDENTITY CASCADE;')
-        print("Таблицы очищены.")
+        videos = data.get('videos', [])
 
-        videos_to_insert = []
-        snapshots_to_insert = []
+        async with conn.transaction():
+            await conn.execute('TRUNCATE TABLE video_snapshots, videos RESTART IDENTITY CASCADE;')
+            print("Таблицы очищены.")
 
-        for video_data in data.get('videos', []):
-            video_id = uuid.UUID(video_data['id'])
-    
-            videos_to_insert.append((
-                video_id,
-                uuid.UUID(video_data['creator_id']),
-                datetime.fromisoformat(video_data['video_created_at']),
-                video_data['views_count'],
-                video_data['likes_count'],
-                video_data['comments_count'],
-                video_data['reports_count'],
-                datetime.fromisoformat(video_data['created_at']),
-                datetime.fromisoformat(video_data['updated_at'])
-            ))
-
-            for snapshot_data in video_data.get('snapshots', []):
-                snapshots_to_insert.append((
-                    uuid.UUID(snapshot_data['id']),
-                    video_id,
-                    snapshot_data['views_count'],
-                    snapshot_data['likes_count'],
-                    snapshot_data['comments_count'],
-                    snapshot_data['reports_count'],
-                    snapshot_data.get('delta_views_count', 0),
-                    snapshot_data.get('delta_likes_count', 0),
-                    snapshot_data.get('delta_comments_count', 0),
-                    snapshot_data.get('delta_reports_count', 0),
-                    datetime.fromisoformat(snapshot_data['created_at'])
-                ))
-        
-        await conn.copy_records_to_table(
-            'videos',
-            records=videos_to_insert,
-            columns=[
-                'id', 'creator_id', 'video_created_at', 'views_count', 'likes_count',
-                'comments_count', 'reports_count', 'created_at', 'updated_at'
-            ]
-        )
-        
-        await conn.copy_records_to_table(
-            'video_snapshots',
-            records=snapshots_to_insert,
-            columns=[
-                'id', 'video_id', 'views_count', 'likes_count', 'comments_count',
-                'reports_count', 'delta_views_count', 'delta_likes_count',
-                'delta_comments_count', 'delta_reports_count', 'created_at'
-            ]
-        )
+            # COPY идёт в UNLOGGED staging-таблицы (без записи в WAL), затем
+            # данные переносятся в целевые таблицы одним INSERT ... SELECT.
+            await conn.execute('CREATE UNLOGGED TABLE videos_stage (LIKE videos INCLUDING DEFAULTS);')
+            await conn.execute('CREATE UNLOGGED TABLE video_snapshots_stage (LIKE video_snapshots INCLUDING DEFAULTS);')
+
+            for index_name, _ in TARGET_INDEXES:
+                await conn.execute(f'DROP INDEX IF EXISTS {index_name};')
+
+            videos_status = await conn.copy_records_to_table(
+                'videos_stage',
+                records=gen_video_records(videos),
+                columns=[
+                    'id', 'creator_id', 'video_created_at', 'views_count', 'likes_count',
+                    'comments_count', 'reports_count', 'created_at', 'updated_at'
+                ]
+            )
+
+            snapshots_status = await conn.copy_records_to_table(
+                'video_snapshots_stage',
+                records=gen_snapshot_records(videos),
+                columns=[
+                    'id', 'video_id', 'views_count', 'likes_count', 'comments_count',
+                    'reports_count', 'delta_views_count', 'delta_likes_count',
+                    'delta_comments_count', 'delta_reports_count', 'created_at'
+                ]
+            )
+
+            await conn.execute('INSERT INTO videos SELECT * FROM videos_stage;')
+            await conn.execute('INSERT INTO video_snapshots SELECT * FROM video_snapshots_stage;')
+            await conn.execute('DROP TABLE videos_stage, video_snapshots_stage;')
+
+            for _, create_index_sql in TARGET_INDEXES:
+                await conn.execute(create_index_sql)
+            print("Индексы перестроены.")
+
+        await conn.execute('REFRESH MATERIALIZED VIEW daily_video_stats;')
+        print("Materialized view daily_video_stats обновлён.")
 
-        print(f"Данные успешно загружены: {len(videos_to_insert)} видео и {len(snapshots_to_insert)} снапшотов.")
+        print(f"Данные успешно загружены (videos: {videos_status}, snapshots: {snapshots_status}).")
 
     except asyncpg.exceptions.PostgresError as e:
         print(f"Ошибка при работе с PostgreSQL: {e}")
@@ -122,4 +182,6 @@ async def load_data():
             print("Соединение с базой данных закрыто.")
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.install()
     asyncio.run(load_data())
@@ -29,3 +29,19 @@ CREATE INDEX IF NOT EXISTS idx_videos_creator_id ON videos(creator_id);
 CREATE INDEX IF NOT EXISTS idx_videos_video_created_at ON videos(video_created_at);
 CREATE INDEX IF NOT EXISTS idx_video_snapshots_video_id ON video_snapshots(video_id);
 CREATE INDEX IF NOT EXISTS idx_video_snapshots_created_at ON video_snapshots(created_at);
+
+-- Дневной rollup по снапшотам: вопросы про прирост за день читают готовые
+-- суммы вместо сканирования всей таблицы video_snapshots.
+-- Обновляется командой REFRESH MATERIALIZED VIEW после загрузки данных.
+CREATE MATERIALIZED VIEW IF NOT EXISTS daily_video_stats AS
+SELECT
+    video_id,
+    DATE(created_at) AS day,
+    SUM(delta_views_count) AS delta_views_count,
+    SUM(delta_likes_count) AS delta_likes_count,
+    SUM(delta_comments_count) AS delta_comments_count,
+    SUM(delta_reports_count) AS delta_reports_count
+FROM video_snapshots
+GROUP BY video_id, DATE(created_at);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_video_stats_video_id_day ON daily_video_stats(video_id, day);